@@ -7,6 +7,7 @@ import numpy as np
 import scipy.special
 import scipy.stats
 import utils
+import warnings
 
 #-----------------------------------------------------------------------------------------------------------------------
 # set up a basic, global logger
@@ -20,7 +21,7 @@ logger = logging.getLogger(__name__)
 def sum_to_scale(values,
                  scale):
     '''
-    Compute a sliding sums array using 1-D convolution. The initial (scale - 1) elements 
+    Compute a sliding sums array using differences of a cumulative sum. The initial (scale - 1) elements 
     of the result array will be padded with np.NaN values. Missing values are not ignored, i.e. if a np.NaN
     (missing) value is part of the group of values to be summed then the sum will be np.NaN
     
@@ -34,23 +35,46 @@ def sum_to_scale(values,
     Y[i] == np.NaN, where i < n
     Y[i] == sum(X[i - n + 1:i + 1]), where i >= n - 1 and X[i - n + 1:i + 1] contains no NaN values
     Y[i] == np.NaN, where i >= n - 1 and X[i - n + 1:i + 1] contains one or more NaN values
+    
+    If the values array has more than one dimension then the sliding sums are computed along the final axis, 
+    for example an array with shape (divisions, months) will have sliding sums computed for each division.
+    
+    Non-finite values (i.e. infinities as well as NaNs) are treated as missing, and the sums are accumulated in double 
+    precision whatever the type of the input array. Since each sum is a difference of running totals, a value which is 
+    many orders of magnitude larger than the rest (for example a fill value such as 1e20 that hasn't been replaced by NaN) 
+    will swamp the precision of all subsequent sums, not only those including it, so fill values should be replaced by NaN 
+    before calling this function. If the number of values is less than the scale then all sums will be NaN. 
          
     :param values: the array of values over which we'll compute sliding sums
     :param scale: the number of values for which each sliding summation will encompass, for example if this value
                   is 3 then the first two elements of the output array will contain the pad value and the third 
                   element of the output array will contain the sum of the first three elements, and so on 
-    :return: an array of sliding sums, equal in length to the input values array, left padded with NaN values  
+    :return: an array of sliding sums, equal in shape to the input values array, left padded with NaN values  
     '''
     
     # don't bother if the number of values to sum is 1 (will result in duplicate array)
     if scale == 1:
         return values
     
-    # get the valid sliding summations with 1D convolution
-    sliding_sums = np.convolve(values, np.ones(scale), mode='valid')
+    # get cumulative sums of the values (with missing values counted as zero) and of the number of missing values, 
+    # each with a leading zero so that the sum over any window is a single difference, i.e. O(n) rather than O(n * scale),
+    # with infinities counted as missing since otherwise every subsequent difference would be NaN, and with the sums 
+    # accumulated as float64 since single precision (e.g. float32 from a NetCDF) loses precision over a long time series 
+    missings = ~np.isfinite(values)
+    leading_zeros = np.zeros(values.shape[:-1] + (1,))
+    cumulative_sums = np.concatenate((leading_zeros, np.cumsum(np.where(missings, 0.0, values), axis=-1, dtype=np.float64)), axis=-1)
+    cumulative_missings = np.concatenate((leading_zeros, np.cumsum(missings, axis=-1)), axis=-1)
+    
+    # the first (n - 1) elements of the array will be padded with NaN values
+    sliding_sums = np.full(values.shape, np.NaN)
+    if values.shape[-1] >= scale:
+        
+        # get the valid sliding summations, with NaN for any sum that includes a missing value
+        window_sums = cumulative_sums[..., scale:] - cumulative_sums[..., :-scale]
+        window_missings = cumulative_missings[..., scale:] - cumulative_missings[..., :-scale]
+        sliding_sums[..., scale - 1:] = np.where(window_missings > 0, np.NaN, window_sums)
     
-    # pad the first (n - 1) elements of the array with NaN values
-    return np.hstack(([np.NaN]*(scale - 1), sliding_sums))
+    return sliding_sums
 
 #-----------------------------------------------------------------------------------------------------------------------
 def _count_zeros_and_non_missings(values):
@@ -283,6 +307,33 @@ def _pearson3_fitting_values(values,
 
     return monthly_fitting_values
 
+#-----------------------------------------------------------------------------------------------------------------------
+def pearson3_fitting_values(monthly_values,
+                            data_start_year,
+                            calibration_start_year,
+                            calibration_end_year):
+    '''
+    Computes the calendar monthly probability of zero and Pearson Type III distribution fitting parameters 
+    corresponding to an array of monthly values, for later use with transform_fitted_pearson() in order to 
+    avoid repeating the fitting when applying the same calibration more than once.
+    
+    :param monthly_values: an array of monthly values, either 1-D or 2-D with each row representing 
+                           a year containing twelve columns representing the respective calendar months
+    :param data_start_year: the initial year of the input values array
+    :param calibration_start_year: the initial year to use for the calibration period 
+    :param calibration_end_year: the final year to use for the calibration period 
+    :return: a 2-D array of monthly fitting values for the Pearson Type III distribution, with shape (4, 12)
+    :rtype: numpy.ndarray of floats
+    '''
+
+    # make sure we have a 2-D array with shape (years, 12), reshaping if we've been passed a 1-D array
+    monthly_values = utils.reshape_to_years_months(monthly_values)
+    
+    return _pearson3_fitting_values(monthly_values, 
+                                    data_start_year,
+                                    calibration_start_year,
+                                    calibration_end_year)
+
 #----------------------------------------------------------------------------------------------------------------------
 @jit
 def _pearson3cdf(value,
@@ -398,7 +449,8 @@ def _error_function(value):
 def transform_fitted_pearson(monthly_values,
                              data_start_year,
                              calibration_start_year,
-                             calibration_end_year):
+                             calibration_end_year,
+                             fitting_values=None):
     '''
     TODO explain this
     
@@ -406,6 +458,8 @@ def transform_fitted_pearson(monthly_values,
     :param data_start_year: the initial year of the input values array
     :param calibration_start_year: the initial year to use for the calibration period 
     :param calibration_end_year: the final year to use for the calibration period 
+    :param fitting_values: optional array of Pearson Type III fitting values with shape (4, 12), as computed by 
+                           pearson3_fitting_values(), if provided then these are used rather than fitting the input values 
     :return: 2-D array of monthly values, corresponding in size and shape of the input array
     :rtype: numpy.ndarray of floats
     '''
@@ -428,18 +482,29 @@ def transform_fitted_pearson(monthly_values,
         logger.error(message)   
         raise ValueError(message)
     
-    # compute the values we'll use to fit to the Pearson Type III distribution
-    monthly_pearson_values = _pearson3_fitting_values(monthly_values, 
-                                                     data_start_year,
-                                                     calibration_start_year,
-                                                     calibration_end_year)
+    # compute the values we'll use to fit to the Pearson Type III distribution, unless we've been provided with them
+    if fitting_values is None:
+        
+        monthly_pearson_values = _pearson3_fitting_values(monthly_values, 
+                                                         data_start_year,
+                                                         calibration_start_year,
+                                                         calibration_end_year)
+    
+    elif fitting_values.shape != (4, 12):
+        
+        message = 'Invalid fitting values array with shape: {0}'.format(fitting_values.shape)
+        logger.error(message)   
+        raise ValueError(message)
+    
+    else:
+        
+        monthly_pearson_values = fitting_values
     
-    # allocate the array of values we'll return, with all values initialized to the fill value (NaN)
+    # allocate the array of probability values (from which we'll compute the values we'll return), with all values initialized to the fill value (NaN)
     fitted_values = np.full(monthly_values.shape, np.NaN)
 
     # compute Pearson CDF -> probability values -> fitted values for the entire period of record
     probability_of_zero = 0.0
-    probability_value = 0.0
     pearson_parameters = np.zeros((3,))
     for year_index in range(monthly_values.shape[0]):
         for calendar_month_index in range(12):
@@ -477,21 +542,24 @@ def transform_fitted_pearson(monthly_values,
                 if not math.isnan(pe3_cdf):
                 
                     # calculate the probability value, clipped between 0 and 1
-                    probability_value = np.clip((probability_of_zero + ((1.0 - probability_of_zero) * pe3_cdf)), 0.0, 1.0)
-    
-                    # the values we'll return are the values at which the probabilities of a normal distribution are less than or equal to
-                    # the computed probabilities, as determined by the normal distribution's quantile (or inverse cumulative distribution) function  
-                    fitted_values[year_index, calendar_month_index] = scipy.stats.norm.ppf(probability_value)
+                    fitted_values[year_index, calendar_month_index] = \
+                        np.clip((probability_of_zero + ((1.0 - probability_of_zero) * pe3_cdf)), 0.0, 1.0)
                 
-    return fitted_values
+    # the values we'll return are the values at which the probabilities of a normal distribution are less than or equal to
+    # the computed probabilities, as determined by the normal distribution's quantile (or inverse cumulative distribution) function,
+    # computed for all probability values at once (missing values remain missing)  
+    return scipy.special.ndtri(fitted_values)
 
 #-----------------------------------------------------------------------------------------------------------------------@jit
-def transform_fitted_gamma(monthly_values):
+def transform_fitted_gamma(monthly_values,
+                           floc=0.0):
     '''
     TODO explain this    
 
     :param monthly_values: an array of monthly values, either 1-D or 2-D with each row representing 
                            a year containing twelve columns representing the respective calendar months
+    :param floc: fixed location parameter (lower bound) of the gamma distribution, the values are fitted 
+                 as the distance above this location, which defaults to zero (the two-parameter gamma distribution)
     :return: 2-D array of monthly values, corresponding in size and shape of the input array if the input is 2-D, or if the input array  
              is 1-D then an equivalent 2-D array with NaN values used to fill the missing months of the final year, if any
     :rtype: numpy.ndarray of floats
@@ -506,7 +574,7 @@ def transform_fitted_gamma(monthly_values):
     if len(monthly_values.shape) == 1:
         
         # we've been passed a 1-D array with shape (months), reshape it to 2-D with shape (years, 12)
-        monthly_values = utils.reshape_to_years_months(monthly_values)
+        reshaped_values = utils.reshape_to_years_months(monthly_values)
     
     elif (len(monthly_values.shape) != 2) or monthly_values.shape[1] != 12:
      
@@ -515,19 +583,77 @@ def transform_fitted_gamma(monthly_values):
         logger.error(message)   
         raise ValueError(message)
     
+    else:
+        
+        # we've been passed a 2-D array with shape (years, 12)
+        reshaped_values = monthly_values
+    
+    # shift the values to be relative to the distribution's location, if other than the default, otherwise
+    # copy the values if they're (a view of) the input array, since zeros are replaced by NaNs in place below
+    if floc != 0.0:
+        reshaped_values = reshaped_values - floc
+    elif np.may_share_memory(reshaped_values, monthly_values):
+        reshaped_values = reshaped_values.copy()
+    
+    return _transform_fitted_gamma_years_months(reshaped_values)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def transform_fitted_gamma_batch(monthly_values,
+                                 floc=0.0):
+    '''
+    Fits the monthly values of many time series (i.e. divisions or grid cells) to the gamma distribution and 
+    transforms the values to corresponding normalized sigmas, as in transform_fitted_gamma(), but for all time series 
+    in a single pass over the array rather than one time series at a time.
+
+    :param monthly_values: an array of monthly values, either 2-D with shape (divisions, months) or 3-D with 
+                           shape (divisions, years, 12), with each time series assumed to start at January
+    :param floc: fixed location parameter (lower bound) of the gamma distribution, the values are fitted 
+                 as the distance above this location, which defaults to zero (the two-parameter gamma distribution)
+    :return: 3-D array of transformed values with shape (divisions, years, 12), with NaN values used to fill 
+             the missing months of the final year, if any, and for any division with all missing values
+    :rtype: numpy.ndarray of floats
+    '''
+    
+    # make sure we have a 3-D array with shape (divisions, years, 12), reshaping if we've been passed a 2-D array
+    reshaped_values = utils.reshape_to_divs_years_months(monthly_values)
+    
+    # shift the values to be relative to the distribution's location, if other than the default, otherwise
+    # copy the values if they're a view of the input array, since zeros are replaced by NaNs in place below
+    if floc != 0.0:
+        reshaped_values = reshaped_values - floc
+    elif np.may_share_memory(reshaped_values, monthly_values):
+        reshaped_values = reshaped_values.copy()
+    
+    # divisions with all missing values will result in warnings from the NaN-ignoring means, and NaN results
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+
+        return _transform_fitted_gamma_years_months(reshaped_values)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _transform_fitted_gamma_years_months(monthly_values):
+    '''
+    Fits monthly values to the gamma distribution and transforms them to corresponding normalized sigmas.
+    
+    :param monthly_values: array of monthly values with the final two dimensions being (years, 12), 
+                           which will have its zero values replaced by NaN values
+    :return: array of transformed values, corresponding in size and shape to the input array
+    :rtype: numpy.ndarray of floats
+    '''
+    
     # find the percentage of zero values for each month
-    zeros = (monthly_values == 0).sum(axis=0)
-    probabilities_of_zero = zeros / monthly_values.shape[0]
+    zeros = (monthly_values == 0).sum(axis=-2, keepdims=True)
+    probabilities_of_zero = zeros / monthly_values.shape[-2]
     
     # replace zeros with NaNs
     monthly_values[monthly_values == 0] = np.NaN
     
     # compute the gamma distribution's shape and scale parameters, alpha and beta
     #TODO explain this better
-    means = np.nanmean(monthly_values, axis=0)
+    means = np.nanmean(monthly_values, axis=-2, keepdims=True)
     log_means = np.log(means)
     logs = np.log(monthly_values)
-    mean_logs = np.nanmean(logs, axis=0)
+    mean_logs = np.nanmean(logs, axis=-2, keepdims=True)
     A = log_means - mean_logs
     alphas = (1 + np.sqrt(1 + 4 * A / 3)) / (4 * A)
     betas = means / alphas
@@ -541,7 +667,7 @@ def transform_fitted_gamma(monthly_values):
     
     # the values we'll return are the values at which the probabilities of a normal distribution are less than or equal to
     # the computed probabilities, as determined by the normal distribution's quantile (or inverse cumulative distribution) function  
-    return scipy.stats.norm.ppf(probabilities)
+    return scipy.special.ndtri(probabilities)
  
 ############################################################################################################################################   
 #-------------------------------------------------------------------------------------------------------------------------------------------
@@ -581,12 +707,11 @@ def transform_fitted_pearson_new(monthly_values,
     if len(monthly_values.shape) == 1:
         monthly_values = utils.reshape_to_years_months(monthly_values)
 
-    # allocate the array of values we'll return, with all values initialized to the fill value (NaN)
+    # allocate the array of probability values (from which we'll compute the values we'll return), with all values initialized to the fill value (NaN)
     fitted_values = np.full(monthly_values.shape, np.NaN)
     
     # compute Pearson CDF -> probability values -> fitted values for the entire period of record
     probability_of_zero = 0.0
-    probability_value = 0.0
     pearson_parameters = np.zeros((3,))
     for year_index in range(monthly_values.shape[0]):
         for calendar_month_index in range(12):
@@ -627,13 +752,13 @@ def transform_fitted_pearson_new(monthly_values,
                 if not math.isnan(pe3_cdf):
                 
                     # calculate the probability value, clipped between 0 and 1
-                    probability_value = np.clip((probability_of_zero + ((1.0 - probability_of_zero) * pe3_cdf)), 0.0, 1.0)
-    
-                    # the values we'll return are the values at which the probabilities of a normal distribution are less than or equal to
-                    # the computed probabilities, as determined by the normal distribution's quantile (or inverse cumulative distribution) function  
-                    fitted_values[year_index, calendar_month_index] = scipy.stats.norm.ppf(probability_value)
+                    fitted_values[year_index, calendar_month_index] = \
+                        np.clip((probability_of_zero + ((1.0 - probability_of_zero) * pe3_cdf)), 0.0, 1.0)
                 
-    return fitted_values
+    # the values we'll return are the values at which the probabilities of a normal distribution are less than or equal to
+    # the computed probabilities, as determined by the normal distribution's quantile (or inverse cumulative distribution) function,
+    # computed for all probability values at once (missing values remain missing)  
+    return scipy.special.ndtri(fitted_values)
 
 #-----------------------------------------------------------------------------------------------------------------------
 #@jit
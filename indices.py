@@ -1,6 +1,8 @@
 import compute
+import functools
 import logging
-from numba import float64, int64, jit
+import multiprocessing
+from numba import float64, int64, njit
 import numpy as np
 import palmer
 import pdinew
@@ -20,8 +22,117 @@ logger = logging.getLogger(__name__)
 _FITTED_INDEX_VALID_MIN = -3.09
 _FITTED_INDEX_VALID_MAX = 3.09
 
+# offset applied to monthly (P - PET) values for SPEI, to ensure that all values are positive when fitted to a distribution
+_SPEI_MONTHLY_OFFSET = 1000.0
+
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def _fitted_index(scaled_values,
+                  original_length,
+                  distribution,
+                  data_start_year=None,
+                  calibration_year_initial=1981,
+                  calibration_year_final=2010,
+                  floc=0.0,
+                  fitting_values=None):
+    '''
+    Fits scaled values to a distribution, transforms the values to corresponding normalized sigmas, and clips these 
+    to within the valid range. This is the part of the computation that is common to both SPI and SPEI.
+    
+    :param scaled_values: 1-D array of monthly values (precipitation or P - PET) scaled to a number of months
+    :param original_length: the length of the original monthly values array, i.e. the length of the array to return 
+    :param distribution: the distribution to which the scaled values are fitted, either 'gamma' or 'pearson'
+    :param data_start_year: the initial year of the input values, used only for the Pearson Type III distribution
+    :param calibration_year_initial: initial year of the calibration period, used only for the Pearson Type III distribution 
+    :param calibration_year_final: final year of the calibration period, used only for the Pearson Type III distribution 
+    :param floc: fixed location parameter (lower bound) of the distribution, used only for the gamma distribution
+    :param fitting_values: optional array of precomputed fitting values, used only for the Pearson Type III distribution
+    :return: fitted/transformed index values, unitless
+    :rtype: 1-D numpy.ndarray of floats of the original length
+    '''
+
+    # fit the scaled values to the distribution and transform the values to corresponding normalized sigmas 
+    if distribution == 'gamma':
+        
+        # fitting values are only precomputed for the Pearson Type III distribution, so we shouldn't have any here
+        if fitting_values is not None:
+            message = 'Extraneous argument: fitting values are only used for the Pearson Type III distribution'
+            logger.error(message)
+            raise ValueError(message)
+
+        transformed_fitted_values = compute.transform_fitted_gamma(scaled_values, floc=floc)
+    
+    elif distribution == 'pearson':
+        
+#         transformed_fitted_values = compute.transform_fitted_pearson_new(scaled_values, 
+#                                                                          data_start_year,
+#                                                                          calibration_year_initial,
+#                                                                          calibration_year_final)
+        transformed_fitted_values = compute.transform_fitted_pearson(scaled_values, 
+                                                                     data_start_year,
+                                                                     calibration_year_initial,
+                                                                     calibration_year_final,
+                                                                     fitting_values)
+
+    else:
+        
+        message = 'Unsupported distribution: {0} (must be either \'gamma\' or \'pearson\')'.format(distribution)
+        logger.error(message)
+        raise ValueError(message)
+    
+    # the transforms return their input array as is when it's all missing values, and at a 1-month scale that's 
+    # the caller's own array (not necessarily of floats), so in that case return a new array of missing values instead
+    if transformed_fitted_values is scaled_values:
+        return np.full((original_length,), np.nan)
+        
+    # reshape the array back to 1-D (a view rather than a copy) and trim it to the original size
+    fitted_index = transformed_fitted_values.ravel()[0:original_length]
+    
+    # clip values to within the valid range, in place, and return the original size array 
+    return np.clip(fitted_index, _FITTED_INDEX_VALID_MIN, _FITTED_INDEX_VALID_MAX, out=fitted_index)
+
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def spi(precips, 
+        months_scale,
+        distribution='gamma',
+        data_start_year=None,
+        calibration_year_initial=1981,
+        calibration_year_final=2010,
+        fitting_values=None):
+    '''
+    Computes monthly SPI using a fitting to either the gamma or the Pearson Type III distribution.
+    
+    :param precips: monthly precipitation values, in any units, first value assumed to correspond to January of the initial year
+    :param months_scale: number of months over which the values should be scaled before the index is computed
+    :param distribution: the distribution to which the scaled values are fitted, either 'gamma' or 'pearson'
+    :param data_start_year: the initial year of the input precipitation dataset, required for the Pearson Type III distribution
+    :param calibration_year_initial: initial year of the calibration period, used only for the Pearson Type III distribution
+    :param calibration_year_final: final year of the calibration period, used only for the Pearson Type III distribution
+    :param fitting_values: optional array of Pearson Type III fitting values with shape (4, 12), as computed by 
+                           spi_pearson_fitting_values() for the same months scale, if provided then the fitting 
+                           is skipped and these are used instead (the calibration years are then ignored)
+    :return monthly SPI values fitted to the distribution at the specified time scale, unitless
+    :rtype: 1-D numpy.ndarray of floats corresponding in length to the input array of monthly precipitation values
+    '''
+
+    # we need the data start year in order to determine the calibration period for the Pearson Type III distribution
+    if (distribution == 'pearson') and (data_start_year is None):
+        message = 'Missing argument: the data start year must be specified for the Pearson Type III distribution'
+        logger.error(message)
+        raise ValueError(message)
+    
+    # get a sliding sums array, with each month's value scaled by the specified number of months
+    scaled_precips = compute.sum_to_scale(precips, months_scale)
+
+    # fit and transform the scaled values, returning an array of the same size as the original
+    return _fitted_index(scaled_precips,
+                         precips.size,
+                         distribution,
+                         data_start_year,
+                         calibration_year_initial,
+                         calibration_year_final,
+                         fitting_values=fitting_values)
+
 #-------------------------------------------------------------------------------------------------------------------------------------------
-@jit(float64[:](float64[:], int64))
 def spi_gamma(precips, 
               months_scale):
     '''
@@ -33,28 +144,55 @@ def spi_gamma(precips,
     :rtype: 1-D numpy.ndarray of floats corresponding in length to the input array of monthly precipitation values
     '''
 
-    # remember the original length of the array, in order to facilitate returning an array of the same size
-    original_length = precips.size
+    return spi(precips, months_scale, 'gamma')
+
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def spi_gamma_batch(precips, 
+                    months_scale,
+                    dtype=np.float64):
+    '''
+    Computes monthly SPI using a fitting to the gamma distribution for many time series at once, for example all
+    divisions or all grid cells of a dataset, giving the same results as computing spi_gamma() for each time series 
+    but with the sums, fitting, and transformation each done in a single vectorized pass over the entire array.
     
-    # get a sliding sums array, with each month's value scaled by the specified number of months
+    :param precips: 2-D array of monthly precipitation values with shape (divisions, months), in any units, 
+                    with the first value of each time series assumed to correspond to January of the initial year
+    :param months_scale: number of months over which the values should be scaled before the index is computed
+    :param dtype: the floating point data type of the returned array, for example numpy.float32 can be used to halve 
+                  the memory required for the result when double precision isn't required downstream
+    :return monthly SPI values fitted to the gamma distribution at the specified time scale, unitless
+    :rtype: 2-D numpy.ndarray of floats corresponding in shape to the input array of monthly precipitation values
+    '''
+
+    # validate the input array's shape
+    if precips.ndim != 2:
+        message = 'Invalid precipitation array with shape: {0} (must be 2-D with shape (divisions, months))'.format(precips.shape)
+        logger.error(message)
+        raise ValueError(message)
+    
+    # remember the original shape of the array, in order to facilitate returning an array of the same shape
+    divisions, original_length = precips.shape
+    
+    # get a sliding sums array, with each month's value scaled by the specified number of months, for each division
     scaled_precips = compute.sum_to_scale(precips, months_scale)
 
     # fit the scaled values to a gamma distribution and transform the values to corresponding normalized sigmas 
-    transformed_fitted_values = compute.transform_fitted_gamma(scaled_precips)
+    transformed_fitted_values = compute.transform_fitted_gamma_batch(scaled_precips)
 
-    # clip values to within the valid range, reshape the array back to 1-D
-    spi = np.clip(transformed_fitted_values, _FITTED_INDEX_VALID_MIN, _FITTED_INDEX_VALID_MAX).flatten()
+    # reshape the array back to (divisions, months) and trim it to the original size (views rather than copies),
+    # converting to the requested data type before clipping (a copy only if other than the default of float64)
+    spi = transformed_fitted_values.reshape(divisions, -1)[:, 0:original_length].astype(dtype, copy=False)
     
-    # return the original size array 
-    return spi[0:original_length]
+    # clip values to within the valid range, in place, and return the original size array 
+    return np.clip(spi, _FITTED_INDEX_VALID_MIN, _FITTED_INDEX_VALID_MAX, out=spi)
 
 #-------------------------------------------------------------------------------------------------------------------------------------------
-@jit(float64[:](float64[:], int64, int64, int64, int64))
 def spi_pearson(precips, 
                 months_scale,
                 data_start_year,
                 calibration_year_initial=1981,
-                calibration_year_final=2010):
+                calibration_year_final=2010,
+                fitting_values=None):
     '''
     Computes monthly SPI using a fitting to the Pearson Type III distribution.
     
@@ -63,42 +201,117 @@ def spi_pearson(precips,
     :param data_start_year: the initial year of the input precipitation dataset
     :param calibration_year_initial: initial year of the calibration period
     :param calibration_year_initial: final year of the calibration period
+    :param fitting_values: optional array of Pearson Type III fitting values with shape (4, 12), as computed by 
+                           spi_pearson_fitting_values() for the same months scale, if provided then the fitting 
+                           is skipped and these are used instead (the calibration years are then ignored)
     :return monthly SPI values fitted to the Pearson Type III distribution at the specified time scale, unitless
     :rtype: 1-D numpy.ndarray of floats corresponding in length to the input array of monthly precipitation values
     '''
 
-    # remember the original length of the array, in order to facilitate returning an array of the same size
-    original_length = precips.size
+    return spi(precips, 
+               months_scale,
+               'pearson',
+               data_start_year,
+               calibration_year_initial,
+               calibration_year_final,
+               fitting_values)
+
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def spi_pearson_fitting_values(precips, 
+                               months_scale,
+                               data_start_year,
+                               calibration_year_initial=1981,
+                               calibration_year_final=2010):
+    '''
+    Computes the Pearson Type III fitting values used for SPI over a calibration period, allowing the fitting to be done 
+    once and then reused via the fitting_values argument of spi_pearson(), for example when computing SPI again after 
+    new months of precipitation have been appended to the input array.
     
+    :param precips: monthly precipitation values, in any units, first value assumed to correspond to January of the initial year
+    :param months_scale: number of months over which the values should be scaled before the index is computed
+    :param data_start_year: the initial year of the input precipitation dataset
+    :param calibration_year_initial: initial year of the calibration period
+    :param calibration_year_final: final year of the calibration period
+    :return: probability of zero and Pearson Type III distribution fitting parameters for each of the 12 calendar months 
+    :rtype: 2-D numpy.ndarray of floats, with shape (4, 12)
+    '''
+
     # get a sliding sums array, with each month's value scaled by the specified number of months
     scaled_precips = compute.sum_to_scale(precips, months_scale)
 
-    # fit the scaled values to a Pearson Type III distribution and transform the values to corresponding normalized sigmas 
-#     transformed_fitted_values = compute.transform_fitted_pearson_new(scaled_precips, 
-#                                                                      data_start_year,
-#                                                                      calibration_year_initial,
-#                                                                      calibration_year_final)
-    transformed_fitted_values = compute.transform_fitted_pearson(scaled_precips, 
-                                                                 data_start_year,
-                                                                 calibration_year_initial,
-                                                                 calibration_year_final)
+    return compute.pearson3_fitting_values(scaled_precips, 
+                                           data_start_year,
+                                           calibration_year_initial,
+                                           calibration_year_final)
+
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def spi_multi_scale(precips, 
+                    months_scales,
+                    distribution='gamma',
+                    data_start_year=None,
+                    calibration_year_initial=1981,
+                    calibration_year_final=2010,
+                    processes=1):
+    '''
+    Computes monthly SPI at several months scales in one run, optionally computing the months scales in parallel 
+    using a pool of processes since the SPI at each months scale is independent of the others.
+    
+    :param precips: monthly precipitation values, in any units, first value assumed to correspond to January of the initial year
+    :param months_scales: the numbers of months over which the values should be scaled before the index is computed, 
+                          for example [1, 3, 6, 9, 12, 24]
+    :param distribution: the distribution to which the scaled values are fitted, either 'gamma' or 'pearson'
+    :param data_start_year: the initial year of the input precipitation dataset, required for the Pearson Type III distribution
+    :param calibration_year_initial: initial year of the calibration period, used only for the Pearson Type III distribution
+    :param calibration_year_final: final year of the calibration period, used only for the Pearson Type III distribution
+    :param processes: the number of worker processes to use, or None to use one per CPU, the default of 1 computes 
+                      the months scales serially in the current process, which is required if this function is called 
+                      from within a pooled process (for example by the process_*.py scripts) since those can't have children 
+    :return: monthly SPI values for each of the months scales, with each row corresponding to the months scale 
+             at the same position of the months scales argument
+    :rtype: 2-D numpy.ndarray of floats, with shape (number of months scales, size of the input precipitation array)
+    '''
+
+    # function computing the SPI for a single months scale, with all other arguments fixed
+    compute_spi = functools.partial(spi,
+                                    precips,
+                                    distribution=distribution,
+                                    data_start_year=data_start_year,
+                                    calibration_year_initial=calibration_year_initial,
+                                    calibration_year_final=calibration_year_final)
+    
+    if processes == 1:
         
-    # clip values to within the valid range, reshape the array back to 1-D
-    spi = np.clip(transformed_fitted_values, _FITTED_INDEX_VALID_MIN, _FITTED_INDEX_VALID_MAX).flatten()
+        # compute the SPI for each of the months scales in turn
+        spi_values = [compute_spi(months_scale) for months_scale in months_scales]
     
-    # return the original size array 
-    return spi[0:original_length]
+    else:
+        
+        # compute the SPI for the months scales in parallel, the precipitation array is pickled 
+        # to the worker processes, which is inexpensive for a single time series (forking the workers
+        # is only safe since none of the numba code used here is parallel, as numba's default TBB 
+        # threading layer hangs forked processes at shutdown, so keep it that way)
+        pool = multiprocessing.Pool(processes=processes)
+        try:
+            spi_values = pool.map(compute_spi, months_scales)
+        finally:
+            pool.close()
+            pool.join()
+
+    return np.array(spi_values)
 
 #-------------------------------------------------------------------------------------------------------------------------------------------
-@jit(float64[:](int64, float64[:], float64[:], float64[:], int64, float64))
-def spei_gamma(months_scale,
-               precips_mm,
-               pet_mm=None,
-               temps_celsius=None,
-               data_start_year=None,
-               latitude_degrees=None):
+def spei(months_scale,
+         precips_mm,
+         distribution='gamma',
+         pet_mm=None,
+         temps_celsius=None,
+         data_start_year=None,
+         latitude_degrees=None,
+         calibration_year_initial=1981,
+         calibration_year_final=2010,
+         fitting_values=None):
     '''
-    Compute SPEI fitted to the gamma distribution.
+    Compute SPEI fitted to either the gamma or the Pearson Type III distribution.
     
     PET values are subtracted from the monthly precipitation values to come up with an array of (P - PET) values, which is 
     then scaled to the specified months scale and finally fitted/transformed to monthly SPEI values corresponding to the
@@ -109,37 +322,44 @@ def spei_gamma(months_scale,
     of PET values should not be specified and if so will result in an error being raised indicating invalid arguments.
     
     If an input array of PET values is provided then an input array of temperature values should not be specified (nor the latitude 
-    and data start year arguments), and if so will result in an error being raised indicating invalid arguments.
+    argument), and if so will result in an error being raised indicating invalid arguments.
         
+    :param months_scale: the number of months over which the values should be scaled before computing the index
     :param precips_mm: an array of monthly total precipitation values, in millimeters, should be of the same size 
                        (and shape?) as the input temperature array
+    :param distribution: the distribution to which the scaled values are fitted, either 'gamma' or 'pearson'
     :param pet_mm: an array of monthly PET values, in millimeters, should be of the same size (and shape?) as 
                    the input precipitation array, must be unspecified or None if using an array of temperature values as input
     :param temps_celsius: an array of monthly average temperature values, in degrees Celsius, should be of the same size 
                           (and shape?) as the input precipitation array, must be unspecified or None if using an array 
                           of PET values as input
     :param data_start_year: the initial year of the input datasets (assumes that the two inputs cover the same period),
-                            must be unspecified or None if using PET values as an input, and must be specified if using 
-                            an array of temperatures as input
+                            must be specified if using an array of temperatures as input or if using the Pearson Type III 
+                            distribution, otherwise it's unused
     :param latitude_degrees: the latitude of the location, in degrees north, must be unspecified or None if using an array 
                              of PET values as an input, and must be specified if using an array of temperatures as input,
                              valid range is -90 to 90, inclusive
-    :param months_scale: the number of months over which the values should be scaled before computing the indicator
+    :param calibration_year_initial: initial year of the calibration period, used only for the Pearson Type III distribution 
+    :param calibration_year_final: final year of the calibration period, used only for the Pearson Type III distribution 
+    :param fitting_values: optional array of Pearson Type III fitting values with shape (4, 12), as computed by 
+                           spei_pearson_fitting_values() for the same months scale, if provided then the fitting 
+                           is skipped and these are used instead (the calibration years are then ignored), 
+                           used only for the Pearson Type III distribution
     :return: an array of SPEI values
     :rtype: numpy.ndarray of type float, of the same size and shape as the input temperature and precipitation arrays
     '''
     
     # validate the function's argument combinations
-    if temps_celsius != None:
+    if temps_celsius is not None:
         
         # since we have temperature then it's expected that we'll compute PET internally, so we shouldn't have PET as an input
-        if pet_mm != None:
+        if pet_mm is not None:
             message = 'Incompatible arguments: either temperature or PET arrays can be specified as arguments, but not both' 
             logger.error(message)
             raise ValueError(message)
         
         # we'll need both the latitude and data start year in order to compute PET 
-        elif (latitude_degrees == None) or (data_start_year == None):
+        elif (latitude_degrees is None) or (data_start_year is None):
             message = 'Missing arguments: since temperature is provided as an input then both latitude ' + \
                       'and the data start year must also be specified, and one or both is not'
             logger.error(message)
@@ -154,18 +374,12 @@ def spei_gamma(months_scale,
         # compute PET
         pet_mm = pet(temps_celsius, latitude_degrees, data_start_year)
 
-    elif pet_mm != None:
-        
-        # since we have PET as input we shouldn't have temperature as an input
-        if temps_celsius != None:
-            message = 'Incompatible arguments: either temperature or PET arrays can be specified as arguments, but not both.' 
-            logger.error(message)
-            raise ValueError(message)
+    elif pet_mm is not None:
         
         # make sure there's no confusion by not allowing a user to specify unnecessary parameters 
-        elif (latitude_degrees != None) or (data_start_year != None):
-            message = 'Extraneous arguments: since PET is provided as an input then both latitude ' + \
-                      'and the data start year must not also be specified, and one or both is.'
+        if latitude_degrees is not None:
+            message = 'Extraneous arguments: since PET is provided as an input then latitude ' + \
+                      'must not also be specified.'
             logger.error(message)
             raise ValueError(message)
             
@@ -175,26 +389,85 @@ def spei_gamma(months_scale,
             logger.error(message)
             raise ValueError(message)
 
-    # subtract the PET from precipitation, adding an offset to ensure that all values are positive
-    p_minus_pet = (precips_mm - pet_mm) + 1000.0
+    else:
+        
+        # we need either temperature or PET as an input
+        message = 'Missing arguments: either temperature or PET arrays must be specified as arguments'
+        logger.error(message)
+        raise ValueError(message)
+
+    # subtract the PET from precipitation, into a single new array which can then be offset in place if necessary
+    p_minus_pet = np.subtract(precips_mm, pet_mm, dtype=np.float64)
+
+    if distribution == 'gamma':
+        
+        # the scaled values will be fitted using a location below the data (the equivalent 
+        # of a monthly offset) to ensure that all values fitted are positive
+        floc = -_SPEI_MONTHLY_OFFSET * months_scale
+    
+    elif distribution == 'pearson':
+
+        # we need the data start year in order to determine the calibration period
+        if data_start_year is None:
+            message = 'Missing argument: the data start year must be specified for the Pearson Type III distribution'
+            logger.error(message)
+            raise ValueError(message)
+
+        # add an offset to ensure that all values are positive, in place to avoid a second temporary array
+        p_minus_pet += _SPEI_MONTHLY_OFFSET
+        floc = 0.0
+    
+    else:
         
-    # remember the original length of the input array, in order to facilitate returning an array of the same size
-    original_length = precips_mm.size
+        message = 'Unsupported distribution: {0} (must be either \'gamma\' or \'pearson\')'.format(distribution)
+        logger.error(message)
+        raise ValueError(message)
     
     # get a sliding sums array, with each month's value scaled by the specified number of months
     scaled_values = compute.sum_to_scale(p_minus_pet, months_scale)
 
-    # fit the scaled values to a gamma distribution and transform the values to corresponding normalized sigmas 
-    transformed_fitted_values = compute.transform_fitted_gamma(scaled_values)
+    # fit and transform the scaled values, returning an array of the same size as the original
+    return _fitted_index(scaled_values,
+                         precips_mm.size,
+                         distribution,
+                         data_start_year,
+                         calibration_year_initial,
+                         calibration_year_final,
+                         floc=floc,
+                         fitting_values=fitting_values)
+
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def spei_gamma(months_scale,
+               precips_mm,
+               pet_mm=None,
+               temps_celsius=None,
+               data_start_year=None,
+               latitude_degrees=None):
+    '''
+    Compute SPEI fitted to the gamma distribution. See spei() for details of how the arguments are used.
         
-    # clip values to within the valid range, reshape the array back to 1-D
-    spei = np.clip(transformed_fitted_values, _FITTED_INDEX_VALID_MIN, _FITTED_INDEX_VALID_MAX).flatten()
+    :param months_scale: the number of months over which the values should be scaled before computing the indicator
+    :param precips_mm: an array of monthly total precipitation values, in millimeters
+    :param pet_mm: an array of monthly PET values, in millimeters, must be unspecified or None if using an array 
+                   of temperature values as input
+    :param temps_celsius: an array of monthly average temperature values, in degrees Celsius, must be unspecified 
+                          or None if using an array of PET values as input
+    :param data_start_year: the initial year of the input datasets, must be specified if using an array of temperatures as input
+    :param latitude_degrees: the latitude of the location, in degrees north, must be unspecified or None if using an array 
+                             of PET values as an input, and must be specified if using an array of temperatures as input
+    :return: an array of SPEI values
+    :rtype: numpy.ndarray of type float, of the same size and shape as the input temperature and precipitation arrays
+    '''
     
-    # return the original size array 
-    return spei[0:original_length]
+    return spei(months_scale,
+                precips_mm,
+                'gamma',
+                pet_mm,
+                temps_celsius,
+                data_start_year,
+                latitude_degrees)
 
 #-------------------------------------------------------------------------------------------------------------------------------------------
-@jit(float64[:](int64, int64, float64[:], float64[:], float64[:], float64, int64, int64))
 def spei_pearson(months_scale,
                  data_start_year,
                  precips_mm,
@@ -202,114 +475,134 @@ def spei_pearson(months_scale,
                  temps_celsius=None,
                  latitude_degrees=None,
                  calibration_year_initial=1981,
-                 calibration_year_final=2010):
+                 calibration_year_final=2010,
+                 fitting_values=None):
     '''
-    Compute SPEI fitted to the Pearson Type III distribution.
-    
-    PET values are subtracted from the monthly precipitation values to come up with an array of (P - PET) values, which is 
-    then scaled to the specified months scale and finally fitted/transformed to monthly SPEI values corresponding to the
-    input monthly precipitation time series.
-
-    If an input array of temperature values is provided then PET values are computed internally using the input temperature
-    array, data start year, and latitude value (all three of which are required in combination). In this case an input array 
-    of PET values should not be specified and if so will result in an error being raised indicating invalid arguments.
-    
-    If an input array of PET values is provided then an input array of temperature values should not be specified (nor the latitude 
-    and data start year arguments), and if so will result in an error being raised indicating invalid arguments.
+    Compute SPEI fitted to the Pearson Type III distribution. See spei() for details of how the arguments are used.
         
     :param months_scale: the number of months over which the values should be scaled before computing the index
-    :param precips_mm: an array of monthly total precipitation values, in millimeters, should be of the same size 
-                       (and shape?) as the input temperature array
-    :param pet_mm: an array of monthly PET values, in millimeters, should be of the same size (and shape?) as 
-                   the input precipitation array, must be unspecified or None if using an array of temperature values as input
-    :param temps_celsius: an array of monthly average temperature values, in degrees Celsius, should be of the same size 
-                          (and shape?) as the input precipitation array, must be unspecified or None if using an array 
-                          of PET values as input
-    :param data_start_year: the initial year of the input datasets (assumes that the two inputs cover the same period),
-                            must be unspecified or None if using PET values as an input, and must be specified if using 
-                            an array of temperatures as input
+    :param data_start_year: the initial year of the input datasets
+    :param precips_mm: an array of monthly total precipitation values, in millimeters
+    :param pet_mm: an array of monthly PET values, in millimeters, must be unspecified or None if using an array 
+                   of temperature values as input
+    :param temps_celsius: an array of monthly average temperature values, in degrees Celsius, must be unspecified 
+                          or None if using an array of PET values as input
     :param latitude_degrees: the latitude of the location, in degrees north, must be unspecified or None if using an array 
-                             of PET values as an input, and must be specified if using an array of temperatures as input,
-                             valid range is -90 to 90, inclusive
+                             of PET values as an input, and must be specified if using an array of temperatures as input
     :param calibration_start_year: initial year of the calibration period 
     :param calibration_end_year: final year of the calibration period 
+    :param fitting_values: optional array of Pearson Type III fitting values with shape (4, 12), as computed by 
+                           spei_pearson_fitting_values() for the same months scale, if provided then the fitting 
+                           is skipped and these are used instead (the calibration years are then ignored)
     :return: an array of SPEI values
     :rtype: numpy.ndarray of type float, of the same size and shape as the input temperature and precipitation arrays
     '''
     
-    # validate the function's argument combinations
-    if temps_celsius != None:
-        
-        # since we have temperature then it's expected that we'll compute PET internally, so we shouldn't have PET as an input
-        if pet_mm != None:
-            message = 'Incompatible arguments: either temperature or PET arrays can be specified as arguments, but not both' 
-            logger.error(message)
-            raise ValueError(message)
-        
-        # we'll need the latitude in order to compute PET 
-        elif latitude_degrees == None:
-            message = 'Missing arguments: since temperature is provided as an input then both latitude ' + \
-                      'and the data start year must also be specified, and one or both is not'
-            logger.error(message)
-            raise ValueError(message)
+    return spei(months_scale,
+                precips_mm,
+                'pearson',
+                pet_mm,
+                temps_celsius,
+                data_start_year,
+                latitude_degrees,
+                calibration_year_initial,
+                calibration_year_final,
+                fitting_values)
 
-        # validate that the two input arrays are compatible
-        elif precips_mm.size != temps_celsius.size:
-            message = 'Incompatible precipitation and temperature arrays'
-            logger.error(message)
-            raise ValueError(message)
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def spei_pearson_fitting_values(months_scale,
+                                data_start_year,
+                                precips_mm,
+                                pet_mm,
+                                calibration_year_initial=1981,
+                                calibration_year_final=2010):
+    '''
+    Computes the Pearson Type III fitting values used for SPEI over a calibration period, allowing the fitting to be done 
+    once and then reused via the fitting_values argument of spei_pearson(), for example when computing SPEI again after 
+    new months of precipitation and PET have been appended to the input arrays. If only temperatures are available 
+    then the PET can first be computed using pet().
+    
+    :param months_scale: the number of months over which the values should be scaled before computing the index
+    :param data_start_year: the initial year of the input datasets
+    :param precips_mm: an array of monthly total precipitation values, in millimeters
+    :param pet_mm: an array of monthly PET values, in millimeters, should be of the same size as the precipitation array
+    :param calibration_year_initial: initial year of the calibration period
+    :param calibration_year_final: final year of the calibration period
+    :return: probability of zero and Pearson Type III distribution fitting parameters for each of the 12 calendar months 
+    :rtype: 2-D numpy.ndarray of floats, with shape (4, 12)
+    '''
 
-        # compute PET
-        pet_mm = pet(temps_celsius, latitude_degrees, data_start_year)
+    # validate that the two input arrays are compatible
+    if precips_mm.size != pet_mm.size:
+        message = 'Incompatible precipitation and PET arrays'
+        logger.error(message)
+        raise ValueError(message)
 
-    elif pet_mm != None:
-        
-        # since we have PET as input we shouldn't have temperature as an input
-        if temps_celsius != None:
-            message = 'Incompatible arguments: either temperature or PET arrays can be specified as arguments, but not both.' 
-            logger.error(message)
-            raise ValueError(message)
-        
-        # make sure there's no confusion by not allowing a user to specify unnecessary parameters 
-        elif latitude_degrees != None:
-            message = 'Extraneous arguments: since PET is provided as an input then latitude ' + \
-                      'must not also be specified.'
-            logger.error(message)
-            raise ValueError(message)
-            
-        # validate that the two input arrays are compatible
-        elif precips_mm.size != pet_mm.size:
-            message = 'Incompatible precipitation and PET arrays'
-            logger.error(message)
-            raise ValueError(message)
-    
-    # subtract the PET from precipitation, adding an offset to ensure that all values are positive
-    p_minus_pet = (precips_mm - pet_mm) + 1000.0
-        
-    # remember the original length of the input array, in order to facilitate returning an array of the same size
-    original_length = precips_mm.size
+    # subtract the PET from precipitation, adding the same offset as spei() does for the Pearson Type III distribution
+    p_minus_pet = np.subtract(precips_mm, pet_mm, dtype=np.float64)
+    p_minus_pet += _SPEI_MONTHLY_OFFSET
     
     # get a sliding sums array, with each month's value scaled by the specified number of months
     scaled_values = compute.sum_to_scale(p_minus_pet, months_scale)
 
-    # fit the scaled values to a gamma distribution and transform the values to corresponding normalized sigmas 
-    transformed_fitted_values = compute.transform_fitted_pearson(scaled_values, 
-                                                                 data_start_year,
-                                                                 calibration_year_initial,
-                                                                 calibration_year_final)
-#     transformed_fitted_values = compute.transform_fitted_pearson_new(scaled_values, 
-#                                                                      data_start_year,
-#                                                                      calibration_year_initial,
-#                                                                      calibration_year_final)
-        
-    # clip values to within the valid range, reshape the array back to 1-D
-    spei = np.clip(transformed_fitted_values, _FITTED_INDEX_VALID_MIN, _FITTED_INDEX_VALID_MAX).flatten()
+    return compute.pearson3_fitting_values(scaled_values, 
+                                           data_start_year,
+                                           calibration_year_initial,
+                                           calibration_year_final)
+
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def spei_multi_scale(months_scales,
+                     precips_mm,
+                     temps_celsius,
+                     data_start_year,
+                     latitude_degrees,
+                     distribution='gamma',
+                     calibration_year_initial=1981,
+                     calibration_year_final=2010):
+    '''
+    Compute SPEI at several months scales in one run, computing PET from the temperature values only once 
+    and then using it for the SPEI at each of the months scales.
     
-    # return the original size array 
-    return spei[0:original_length]
+    :param months_scales: the numbers of months over which the values should be scaled before computing the index, 
+                          for example [1, 3, 6, 12]
+    :param precips_mm: an array of monthly total precipitation values, in millimeters, should be of the same size 
+                       as the input temperature array
+    :param temps_celsius: an array of monthly average temperature values, in degrees Celsius, should be of the same size 
+                          as the input precipitation array
+    :param data_start_year: the initial year of the input datasets (assumes that the two inputs cover the same period)
+    :param latitude_degrees: the latitude of the location, in degrees north, valid range is -90 to 90, inclusive
+    :param distribution: the distribution to which the scaled values are fitted, either 'gamma' or 'pearson'
+    :param calibration_year_initial: initial year of the calibration period, used only for the Pearson Type III distribution 
+    :param calibration_year_final: final year of the calibration period, used only for the Pearson Type III distribution 
+    :return: an array of SPEI values for each of the months scales, with each row corresponding to the months scale 
+             at the same position of the months scales argument
+    :rtype: 2-D numpy.ndarray of floats, with shape (number of months scales, size of the input precipitation array)
+    '''
+    
+    # validate the function's arguments
+    if precips_mm.size != temps_celsius.size:
+        message = 'Incompatible precipitation and temperature arrays'
+        logger.error(message)
+        raise ValueError(message)
+
+    # compute PET once, to be shared by the SPEI computations at all months scales
+    pet_mm = pet(temps_celsius, latitude_degrees, data_start_year)
+
+    # compute the SPEI for each of the months scales
+    spei_values = np.full((len(months_scales), precips_mm.size), np.nan)
+    for scale_index, months_scale in enumerate(months_scales):
+    
+        spei_values[scale_index] = spei(months_scale, 
+                                        precips_mm, 
+                                        distribution,
+                                        pet_mm=pet_mm,
+                                        data_start_year=data_start_year,
+                                        calibration_year_initial=calibration_year_initial,
+                                        calibration_year_final=calibration_year_final)
+
+    return spei_values
 
 #-------------------------------------------------------------------------------------------------------------------------------------------
-@jit
 def scpdsi(precip_time_series,
            pet_time_series,
            awc,
@@ -338,7 +631,6 @@ def scpdsi(precip_time_series,
                          calibration_end_year)
     
 #-------------------------------------------------------------------------------------------------------------------------------------------
-@jit
 def pdinew_pdsi(precip_time_series,
                 temp_time_series,
                 awc,
@@ -376,7 +668,6 @@ def pdinew_pdsi(precip_time_series,
                                         None)
 
 #-------------------------------------------------------------------------------------------------------------------------------------------
-@jit
 def pdsi(precip_time_series,
          pet_time_series,
          awc,
@@ -405,7 +696,6 @@ def pdsi(precip_time_series,
                        calibration_end_year)
     
 #-------------------------------------------------------------------------------------------------------------------------------------------
-@jit(float64[:](float64[:], int64, int64, int64, int64))
 def percentage_of_normal(monthly_values, 
                          months_scale,
                          data_start_year,
@@ -439,31 +729,75 @@ def percentage_of_normal(monthly_values,
     # to the end the value will equal the sum of the corresponding month plus the values of the two previous months
     months_scale_sums = compute.sum_to_scale(monthly_values, months_scale)
     
-    # extract the months over which we'll compute the normal average for each calendar month
+    # get the indices of the months over which we'll compute the normal average for each calendar month
     calibration_years = calibration_end_year - calibration_start_year + 1
     calibration_start_index = (calibration_start_year - data_start_year) * 12
     calibration_end_index = calibration_start_index + (calibration_years * 12)
-    calibration_period_sums = months_scale_sums[calibration_start_index:calibration_end_index]
+    
+    return _percentage_of_normal(months_scale_sums.astype(np.float64, copy=False), 
+                                 calibration_start_index, 
+                                 calibration_end_index)
+
+#-------------------------------------------------------------------------------------------------------------------------------------------
+@njit(float64[:](float64[:], int64, int64))
+def _percentage_of_normal(months_scale_sums,
+                          calibration_start_index,
+                          calibration_end_index):
+    '''
+    Computes the percentage of normal for each month of an array of months scale sums, with the normal for each calendar month 
+    being the average of that calendar month's sums over a calibration period.
+    
+    :param months_scale_sums: 1-D array of monthly sums at the months scale, initial value assumed to be January
+    :param calibration_start_index: index of the first month of the calibration period, assumed to be a January
+    :param calibration_end_index: index of the month following the final month of the calibration period
+    :return: percent of normal values corresponding to the input months scale sums array   
+    :rtype: numpy.ndarray of type float
+    '''
+    
+    # the calibration period may extend beyond the end of the data
+    calibration_end_index = min(calibration_end_index, months_scale_sums.size)
     
     # for each calendar month in the calibration period, get the average of the scale months sum 
-    # for that calendar month (i.e. average all January sums, then all February sums, etc.) 
+    # for that calendar month (i.e. average all January sums, then all February sums, etc.), ignoring missing values 
     calendar_month_averages = np.full((12,), np.nan)
-    for i in range(12):
-        calendar_month_averages[i] = np.nanmean(calibration_period_sums[i::12])
-    
-    #TODO replace the below loop with a vectorized implementation
-    # for each month of the months_scale_sums array find its corresponding
-    # percentage of the months scale average for its respective calendar month
+    for calendar_month_index in range(12):
+        total = 0.0
+        count = 0
+        for i in range(calibration_start_index + calendar_month_index, calibration_end_index, 12):
+            if not np.isnan(months_scale_sums[i]):
+                total += months_scale_sums[i]
+                count += 1
+        if count > 0:
+            calendar_month_averages[calendar_month_index] = total / count
+    
+    # for each month of the months_scale_sums array find its corresponding percentage of the months scale average 
+    # for its respective calendar month, leaving NaN wherever we'd otherwise have a zero (or missing) divisor
     percentages_of_normal = np.full(months_scale_sums.shape, np.nan)
     for i in range(months_scale_sums.size):
-
-        # make sure we don't have a zero divisor
         if calendar_month_averages[i % 12] > 0.0:
-            
             percentages_of_normal[i] = months_scale_sums[i] / calendar_month_averages[i % 12]
     
     return percentages_of_normal
     
+#-------------------------------------------------------------------------------------------------------------------------------------------
+def _all_nan(values):
+    '''
+    Determines whether or not all values of an array are NaN. The first value is checked before the entire array,
+    since it's typically not NaN, in which case there's no need to scan (and allocate a boolean array for) the entire 
+    array. Masked arrays (and any other numpy.ndarray subclasses) always get the full check, so that masked values 
+    are handled by the subclass's own version of numpy.isnan().
+    
+    :param values: array of values
+    :return: True if all of the values are NaN, otherwise False
+    :rtype: boolean
+    '''
+
+    # the first value is usually valid, in which case we're done without scanning the rest of the array
+    if (type(values) is np.ndarray) and (values.size > 0) and not np.isnan(values.flat[0]):
+        return False
+    
+    return np.all(np.isnan(values))
+
 #-------------------------------------------------------------------------------------------------------------------------------------------
 def pet(temperature_monthly_celsius,
         latitude_degrees,
@@ -479,7 +813,8 @@ def pet(temperature_monthly_celsius,
     :return: an array of PET values, of the same size and shape as the input temperature values array, in millimeters/month
     :rtype: 1-D numpy.ndarray of floats
     '''
-    if not np.all(np.isnan(temperature_monthly_celsius)):
+    # only compute PET if we have at least one temperature value that's not NaN
+    if not _all_nan(temperature_monthly_celsius):
         
         if not np.isnan(latitude_degrees) and (latitude_degrees < 90.0) and (latitude_degrees > -90.0):
         
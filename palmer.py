@@ -33,9 +33,9 @@ def _water_balance(AWC,
     :param P: timeseries of precipitation values, in inches
     :return: numpy arrays for ET, PR, R, RO, PRO, L, and PL 
     """
-    # flatten timeseries to a 1-D array
-    PET = PET.flatten() 
-    P = P.flatten()
+    # flatten timeseries to a 1-D array (a view rather than a copy, since the inputs are only read)
+    PET = PET.ravel() 
+    P = P.ravel()
     
     total_months = PET.shape[0]
 
@@ -695,7 +695,7 @@ def _z_index(P,
             z[n, i] = K[i] * departure
 
     # return the Z-Index values as a 1-D array
-    return z.flatten()
+    return z.ravel()
 
 #-----------------------------------------------------------------------------------------------------------------------
 @numba.jit
@@ -1830,7 +1830,7 @@ def pdi_from_climatology(precip_time_series,
                  calibration_end_year)
 
     # compute PDSI, etc.
-    PDSI, PHDI, PMDI = _pdsi_from_zindex(Z.flatten(), expected_pdsi)
+    PDSI, PHDI, PMDI = _pdsi_from_zindex(Z.ravel(), expected_pdsi)
 
     return PDSI, PHDI, PMDI, Z
 
@@ -1877,7 +1877,7 @@ def pdsi_from_climatology(precip_time_series,
 #                                                                 data_start_year)
 
     return pdsi(precip_time_series,
-                pet_time_series.flatten(),
+                pet_time_series.ravel(),
                 awc,
                 data_start_year,
                 expected_pdsi,
@@ -1917,7 +1917,7 @@ def scpdsi_from_climatology(precip_time_series,
                                                                 latitude, 
                                                                 data_start_year)
     return scpdsi(precip_time_series,
-                  pet_time_series.flatten(),
+                  pet_time_series.ravel(),
                   awc,
                   data_start_year,
                   calibration_start_year,
@@ -450,6 +450,40 @@ class ComputeTestCase(unittest.TestCase):
                                    expected_values, 
                                    err_msg='Sliding sums not computed as expected when missing values appended to end of input array')            
     
+        # test an input array with an infinite value, which should be treated as missing
+        values = np.array([3, 4, 6, 2, np.inf, 3, 5, 8, 5])
+        computed_values = compute.sum_to_scale(values, 3)
+        expected_values = np.array([np.NaN, np.NaN, 13, 12, np.NaN, np.NaN, np.NaN, 16, 18])
+        np.testing.assert_allclose(computed_values, 
+                                   expected_values, 
+                                   err_msg='Sliding sums not computed as expected when an infinite value is within the input array')            
+    
+        # test a single precision input array, the sums should be accumulated in double precision
+        values = np.array([1e8, 1, 1, 1, 1], dtype=np.float32)
+        computed_values = compute.sum_to_scale(values, 2)
+        expected_values = np.array([np.NaN, 100000001, 2, 2, 2])
+        np.testing.assert_allclose(computed_values, 
+                                   expected_values, 
+                                   err_msg='Sliding sums not computed as expected for a single precision input array')            
+    
+        # test an input array with fewer values than the scale
+        values = np.array([3, 4])
+        computed_values = compute.sum_to_scale(values, 3)
+        expected_values = np.array([np.NaN, np.NaN])
+        np.testing.assert_allclose(computed_values, 
+                                   expected_values, 
+                                   err_msg='Sliding sums not computed as expected when input array is shorter than the scale')            
+    
+        # test a 2-D input array, the sums should be computed along the final axis
+        values = np.array([[3, 4, 6, 2, 1, 3, 5, 8, 5],
+                           [3, 4, 6, 2, 1, 3, 5, np.NaN, 8]])
+        computed_values = compute.sum_to_scale(values, 3)
+        expected_values = np.array([[np.NaN, np.NaN, 13, 12, 9, 6, 9, 16, 18],
+                                    [np.NaN, np.NaN, 13, 12, 9, 6, 9, np.NaN, np.NaN]])
+        np.testing.assert_allclose(computed_values, 
+                                   expected_values, 
+                                   err_msg='Sliding sums not computed as expected for a 2-D input array')            
+    
     #----------------------------------------------------------------------------------------
     def test_count_zeros_and_non_missings(self):
         '''
@@ -408,7 +408,50 @@ class IndicesTestCase(unittest.TestCase):
                                    self.fixture_pet_mm,
                                    atol=0.01,
                                    err_msg='PET values not computed as expected')
+
+        # make sure that an all NaN temperature array results in the same array being returned
+        all_nan_temps = np.full(self.fixture_temps_celsius.shape, np.nan)
+        self.assertIs(indices.pet(all_nan_temps, self.fixture_latitude_degrees, self.fixture_initial_data_year), 
+                      all_nan_temps)
         
+        # make sure the same is true for a masked array, as read from a NetCDF
+        all_nan_masked_temps = np.ma.MaskedArray(all_nan_temps)
+        self.assertIs(indices.pet(all_nan_masked_temps, self.fixture_latitude_degrees, self.fixture_initial_data_year), 
+                      all_nan_masked_temps)
+
+    #----------------------------------------------------------------------------------------
+    def test_percentage_of_normal(self):
+
+        # 40 years of monthly values (1981 - 2020) where each calendar month has the same value every year,
+        # with all Augusts having zero values, and with a partial final year of only two months
+        calendar_month_values = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 0.0, 9.0, 10.0, 11.0, 12.0])
+        monthly_values = np.hstack((np.tile(calendar_month_values, 40), calendar_month_values[0:2]))
+
+        # at 1-month scale every month is exactly normal, except for the Augusts which have a zero normal
+        expected_percentages = np.ones(monthly_values.shape)
+        expected_percentages[7::12] = np.nan
+        computed_percentages = indices.percentage_of_normal(monthly_values, 1, 1981, 1981, 2010)
+        np.testing.assert_allclose(computed_percentages,
+                                   expected_percentages,
+                                   err_msg='Percentage of normal values for 1-month scale not computed as expected')
+
+        # at 3-month scale the first two months are missing and every other month is exactly normal
+        expected_percentages = np.ones(monthly_values.shape)
+        expected_percentages[0:2] = np.nan
+        computed_percentages = indices.percentage_of_normal(monthly_values, 3, 1981, 1981, 2010)
+        np.testing.assert_allclose(computed_percentages,
+                                   expected_percentages,
+                                   err_msg='Percentage of normal values for 3-month scale not computed as expected')
+
+        # make sure that a calibration period starting before the data start year raises an error
+        np.testing.assert_raises(ValueError,
+                                 indices.percentage_of_normal,
+                                 monthly_values,
+                                 1,
+                                 1981,
+                                 1971,
+                                 2000)
+
     #----------------------------------------------------------------------------------------
     def test_spi_gamma_1month(self):
         
@@ -687,6 +730,50 @@ class IndicesTestCase(unittest.TestCase):
                                    atol=0.01,
                                    err_msg='SPI/Gamma values for {0}-month scale not computed as expected'.format(month_scale))
 
+    #----------------------------------------------------------------------------------------
+    def test_spi_gamma_batch(self):
+
+        # stack the fixture precipitation values with a wetter variation, a variation with some dry
+        # (zero) months, and a time series of all missing values, as if these were four divisions
+        dry_precips = self.fixture_precips_mm.copy()
+        dry_precips[::7] = 0.0
+        precips = np.vstack((self.fixture_precips_mm,
+                             self.fixture_precips_mm * 1.5 + 10.0,
+                             dry_precips,
+                             np.full(self.fixture_precips_mm.shape, np.nan)))
+
+        # compute SPI/gamma at 6-month scale for all divisions at once
+        month_scale = 6
+        computed_spi = indices.spi_gamma_batch(precips, month_scale)
+        self.assertEqual(computed_spi.shape, precips.shape)
+
+        # make sure each division's values are the same as if computed separately
+        for division_index in range(precips.shape[0]):
+            expected_spi = indices.spi_gamma(precips[division_index].copy(), month_scale)
+            np.testing.assert_allclose(computed_spi[division_index],
+                                       expected_spi,
+                                       atol=1e-8,
+                                       err_msg='Batch SPI/Gamma values for division {0} not computed as expected'.format(division_index))
+
+        # make sure we can get the same values as single precision
+        computed_spi_float32 = indices.spi_gamma_batch(precips, month_scale, dtype=np.float32)
+        self.assertEqual(computed_spi_float32.dtype, np.float32)
+        np.testing.assert_allclose(computed_spi_float32,
+                                   computed_spi,
+                                   atol=1e-5,
+                                   err_msg='Batch SPI/Gamma values not computed as expected as single precision')
+
+        # make sure that the input array isn't modified at 1-month scale, where no sums are computed
+        whole_years_precips = precips[:, 0:(precips.shape[1] // 12) * 12].copy()
+        original_precips = whole_years_precips.copy()
+        indices.spi_gamma_batch(whole_years_precips, 1)
+        np.testing.assert_array_equal(whole_years_precips, 
+                                      original_precips,
+                                      err_msg='Batch SPI/Gamma modified the input precipitation array')
+        
+        # make sure that an input array that's not 2-D raises an error
+        np.testing.assert_raises(ValueError, indices.spi_gamma_batch, self.fixture_precips_mm, month_scale)
+
     #----------------------------------------------------------------------------------------
     def test_spi_pearson_6month(self):
         
@@ -831,6 +918,54 @@ class IndicesTestCase(unittest.TestCase):
                                    atol=0.01,
                                    err_msg='SPI/Pearson values for {0}-month scale not computed as expected'.format(month_scale))
 
+        # compute the fitting values separately and make sure that reusing them gives the same SPI/Pearson values
+        fitting_values = indices.spi_pearson_fitting_values(self.fixture_precips_mm, month_scale, 1895, 1981, 2010)
+        self.assertEqual(fitting_values.shape, (4, 12))
+        computed_spi_from_fitting = indices.spi_pearson(self.fixture_precips_mm,
+                                                        month_scale,
+                                                        1895,
+                                                        fitting_values=fitting_values)
+        np.testing.assert_allclose(computed_spi_from_fitting,
+                                   computed_spi,
+                                   err_msg='SPI/Pearson values not computed as expected when using precomputed fitting values')
+
+    #----------------------------------------------------------------------------------------
+    def test_spei_gamma_6month(self):
+
+        # compute SPEI/gamma at 6-month scale, using precipitation and temperatures as input
+        month_scale = 6
+        computed_spei = indices.spei_gamma(month_scale,
+                                           self.fixture_precips_mm,
+                                           temps_celsius=self.fixture_temps_celsius,
+                                           data_start_year=self.fixture_initial_data_year,
+                                           latitude_degrees=self.fixture_latitude_degrees)
+
+        # the first (months scale - 1) values are missing, and all others should be within the valid range
+        self.assertEqual(computed_spei.size, self.fixture_precips_mm.size)
+        self.assertTrue(np.all(np.isnan(computed_spei[0:month_scale - 1])))
+        self.assertTrue(np.all(np.abs(computed_spei[month_scale - 1:]) <= 3.09))
+
+        # make sure that using the corresponding PET values as input gives the same results
+        computed_spei_from_pet = indices.spei_gamma(month_scale,
+                                                    self.fixture_precips_mm,
+                                                    pet_mm=self.fixture_pet_mm)
+        np.testing.assert_allclose(computed_spei_from_pet,
+                                   computed_spei,
+                                   atol=0.01,
+                                   err_msg='SPEI/gamma values computed from PET not computed as expected')
+
+        # make sure that specifying both or neither of temperature and PET raises an error
+        np.testing.assert_raises(ValueError,
+                                 indices.spei_gamma,
+                                 month_scale,
+                                 self.fixture_precips_mm,
+                                 pet_mm=self.fixture_pet_mm,
+                                 temps_celsius=self.fixture_temps_celsius)
+        np.testing.assert_raises(ValueError,
+                                 indices.spei_gamma,
+                                 month_scale,
+                                 self.fixture_precips_mm)
+
     #----------------------------------------------------------------------------------------
     def test_spei_pearson_6month(self):
          
@@ -979,6 +1114,123 @@ class IndicesTestCase(unittest.TestCase):
                                    expected_spei, 
                                    atol=0.01,
                                    err_msg='SPEI/Pearson values for {0}-month scale not computed as expected'.format(month_scale))
+
+        # compute the fitting values separately and make sure that reusing them gives the same SPEI/Pearson values
+        fitting_values = indices.spei_pearson_fitting_values(month_scale, 1895, self.fixture_precips_mm, self.fixture_pet_mm)
+        self.assertEqual(fitting_values.shape, (4, 12))
+        computed_spei_from_fitting = indices.spei_pearson(month_scale,
+                                                          1895,
+                                                          self.fixture_precips_mm, 
+                                                          pet_mm=self.fixture_pet_mm,
+                                                          fitting_values=fitting_values)
+        np.testing.assert_allclose(computed_spei_from_fitting,
+                                   indices.spei_pearson(month_scale, 1895, self.fixture_precips_mm, pet_mm=self.fixture_pet_mm),
+                                   err_msg='SPEI/Pearson values not computed as expected when using precomputed fitting values')
+
+    #----------------------------------------------------------------------------------------
+    def test_spei_multi_scale(self):
+
+        # compute SPEI at several months scales in one run, for both distributions
+        month_scales = [1, 3, 6]
+        for distribution, spei_function in (('gamma', indices.spei_gamma), ('pearson', indices.spei_pearson)):
+            
+            computed_spei = indices.spei_multi_scale(month_scales,
+                                                     self.fixture_precips_mm,
+                                                     self.fixture_temps_celsius,
+                                                     self.fixture_initial_data_year,
+                                                     self.fixture_latitude_degrees,
+                                                     distribution=distribution)
+            self.assertEqual(computed_spei.shape, (len(month_scales), self.fixture_precips_mm.size))
+
+            # make sure each months scale's values are the same as if computed separately
+            for scale_index, month_scale in enumerate(month_scales):
+                if distribution == 'gamma':
+                    expected_spei = spei_function(month_scale,
+                                                  self.fixture_precips_mm,
+                                                  pet_mm=self.fixture_pet_mm)
+                else:
+                    expected_spei = spei_function(month_scale,
+                                                  self.fixture_initial_data_year,
+                                                  self.fixture_precips_mm,
+                                                  pet_mm=self.fixture_pet_mm)
+                np.testing.assert_allclose(computed_spei[scale_index],
+                                           expected_spei,
+                                           atol=0.01,
+                                           err_msg='SPEI/{0} values for {1}-month scale not computed as expected'.format(distribution, 
+                                                                                                                      month_scale))
+
+        # make sure that an unsupported distribution raises an error
+        np.testing.assert_raises(ValueError,
+                                 indices.spei_multi_scale,
+                                 month_scales,
+                                 self.fixture_precips_mm,
+                                 self.fixture_temps_celsius,
+                                 self.fixture_initial_data_year,
+                                 self.fixture_latitude_degrees,
+                                 'weibull')
+
+    #----------------------------------------------------------------------------------------
+    def test_spi_multi_scale(self):
+
+        # compute SPI at several months scales in one run, both serially and in parallel
+        month_scales = [1, 3, 6]
+        for processes in (1, 2):
+            
+            computed_spi = indices.spi_multi_scale(self.fixture_precips_mm,
+                                                   month_scales,
+                                                   processes=processes)
+            self.assertEqual(computed_spi.shape, (len(month_scales), self.fixture_precips_mm.size))
+
+            # make sure each months scale's values are the same as if computed separately
+            for scale_index, month_scale in enumerate(month_scales):
+                np.testing.assert_allclose(computed_spi[scale_index],
+                                           indices.spi_gamma(self.fixture_precips_mm, month_scale),
+                                           err_msg='SPI/Gamma values for {0}-month scale not computed as expected'.format(month_scale))
+
+        # make sure that the input array isn't modified, which would affect the months scales that follow the first, using
+        # whole years (the input is then reshaped without a copy) and some dry (zero) months, starting with a 1-month scale
+        precips = self.fixture_precips_mm[0:(self.fixture_precips_mm.size // 12) * 12].copy()
+        precips[::10] = 0.0
+        original_precips = precips.copy()
+        computed_spi = indices.spi_multi_scale(precips, month_scales)
+        np.testing.assert_array_equal(precips, 
+                                      original_precips,
+                                      err_msg='Multi-scale SPI/Gamma modified the input precipitation array')
+        for scale_index, month_scale in enumerate(month_scales):
+            np.testing.assert_allclose(computed_spi[scale_index],
+                                       indices.spi_gamma(original_precips.copy(), month_scale),
+                                       err_msg='SPI/Gamma values for {0}-month scale with dry months not computed as expected'.format(month_scale))
+
+    #----------------------------------------------------------------------------------------
+    def test_spi_spei_distribution(self):
+
+        # make sure the general SPI and SPEI functions give the same results as the distribution specific functions
+        np.testing.assert_allclose(indices.spi(self.fixture_precips_mm, 6, 'gamma'),
+                                   indices.spi_gamma(self.fixture_precips_mm, 6),
+                                   err_msg='SPI/Gamma values not computed as expected')
+        np.testing.assert_allclose(indices.spi(self.fixture_precips_mm, 6, 'pearson', self.fixture_initial_data_year),
+                                   indices.spi_pearson(self.fixture_precips_mm, 6, self.fixture_initial_data_year),
+                                   err_msg='SPI/Pearson values not computed as expected')
+        np.testing.assert_allclose(indices.spei(6, self.fixture_precips_mm, 'gamma', pet_mm=self.fixture_pet_mm),
+                                   indices.spei_gamma(6, self.fixture_precips_mm, pet_mm=self.fixture_pet_mm),
+                                   err_msg='SPEI/Gamma values not computed as expected')
+
+        # make sure that an unsupported distribution or a missing data start year raises an error
+        np.testing.assert_raises(ValueError, indices.spi, self.fixture_precips_mm, 6, 'weibull')
+        np.testing.assert_raises(ValueError, indices.spi, self.fixture_precips_mm, 6, 'pearson')
+        np.testing.assert_raises(ValueError, indices.spi, self.fixture_precips_mm, 6, 'gamma', 
+                                 fitting_values=np.zeros((4, 12)))
+        np.testing.assert_raises(ValueError, indices.spei, 6, self.fixture_precips_mm, 'weibull', self.fixture_pet_mm)
+        np.testing.assert_raises(ValueError, indices.spei, 6, self.fixture_precips_mm, 'pearson', self.fixture_pet_mm)
+
+        # make sure that all missing input results in a new array of missing values, leaving the input array unchanged
+        for distribution in ('gamma', 'pearson'):
+            all_nan_precips = np.full(self.fixture_precips_mm.shape, np.nan, dtype=np.float32)
+            computed_spi = indices.spi(all_nan_precips, 1, distribution, self.fixture_initial_data_year)
+            self.assertIsNot(computed_spi, all_nan_precips)
+            self.assertEqual(computed_spi.dtype, np.float64)
+            self.assertTrue(np.all(np.isnan(computed_spi)))
+        
         
 #--------------------------------------------------------------------------------------------
 if __name__ == '__main__':